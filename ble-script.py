@@ -1,135 +1,283 @@
 import asyncio
+import os
+import sys
+from collections.abc import Awaitable, Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from pathlib import Path
 from bleak import BleakClient, BleakScanner
+from bleak.exc import BleakDeviceNotFoundError, BleakError
 
 MELK_NAMES = ("MELK-OA21",)
+_MELK_NAMES_LC = tuple(n.lower() for n in MELK_NAMES)
 SCAN_TIMEOUT_S = 1.0
 CONNECT_TIMEOUT_S = 8.0
+# Bleak's own device lookup/connect timeout; kept below CONNECT_TIMEOUT_S so a missing
+# device surfaces as BleakDeviceNotFoundError rather than our outer wait_for timing out.
+CLIENT_TIMEOUT_S = 5.0
 WRITE_UUID = "0000fff3-0000-1000-8000-00805f9b34fb"
 WRITE_WITH_RESPONSE = False
 
-# Some devices need a tiny delay after write.
+# Some devices need a tiny delay after write; it is enforced as a gap before the next write.
 POST_WRITE_DELAY_S = 0.05
 DEFAULT_IDLE_TIMEOUT_S = 300.0
+# Echo each written packet. Defaults to on for a terminal, off when piped; MELK_VERBOSE overrides
+# (0/false/no/off disable, anything else enables).
+_verbose_env = os.environ.get("MELK_VERBOSE")
+if _verbose_env is None:
+    VERBOSE = sys.stdout.isatty()
+else:
+    VERBOSE = _verbose_env.strip().lower() not in ("", "0", "false", "no", "off")
+# Last address that connected; lets startup skip the scan entirely.
+CACHED_ADDRESS_PATH = Path.home() / ".cache" / "melk-addr"
 
 # Serialize connect/write/disconnect so rapid commands don't collide.
+# asyncio.Lock already acquires without suspending when uncontended, which is the REPL case.
 _tx_lock = asyncio.Lock()
 _resolved_device = None
 _client = None
+# Last observed link state, so hot paths skip the backend's is_connected property.
+_connected = False
+# One scanner for the whole session; recreating it per resolve churns the backend (DBus on BlueZ).
+_scanner = None
+_scan_found = None
 _idle_timeout_s = DEFAULT_IDLE_TIMEOUT_S
+# Commands only move the idle deadline; one loop timer handle fires at it.
+_idle_deadline = 0.0
+_idle_handle = None
 _idle_task = None
+_next_write_ok = 0.0
+# Power state from the last on/off packet we wrote; None until one is sent.
+_light_on = None
+# input() blocks between commands; keep it off the default executor other libraries share.
+_stdin_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="melk-stdin")
 
 
-def pkt_power(on: bool) -> bytearray:
-    return bytearray([0x7E, 0x00, 0x04, 0x01 if on else 0x00, 0x00, 0x00, 0x00, 0x00, 0xEF])
+def pkt_power(on: bool) -> bytes:
+    return bytes((0x7E, 0x00, 0x04, 0x01 if on else 0x00, 0x00, 0x00, 0x00, 0x00, 0xEF))
 
 
-def pkt_color(r: int, g: int, b: int) -> bytearray:
-    for v in (r, g, b):
-        if not (0 <= v <= 255):
-            raise ValueError("RGB values must be in 0..255")
-    return bytearray([0x7E, 0x00, 0x05, 0x03, r, g, b, 0x00, 0xEF])
+def pkt_color(r: int, g: int, b: int) -> bytes:
+    if (r | g | b) & ~0xFF:
+        raise ValueError("RGB values must be in 0..255")
+    return bytes((0x7E, 0x00, 0x05, 0x03, r, g, b, 0x00, 0xEF))
+
+
+# Fixed commands are built once; only `color R G B` needs a fresh packet.
+PKT_ON = pkt_power(True)
+PKT_OFF = pkt_power(False)
+PRESETS = {
+    "red": pkt_color(255, 0, 0),
+    "green": pkt_color(0, 255, 0),
+    "blue": pkt_color(0, 0, 255),
+    "white": pkt_color(255, 255, 255),
+}
 
 
 async def ainput(prompt: str = "") -> str:
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(input, prompt))
+    return await loop.run_in_executor(_stdin_pool, partial(input, prompt))
+
+
+def _on_scan_detect(device, advertisement_data) -> None:
+    if _scan_found is None or _scan_found.done():
+        return
+    # Substring match, so surrounding whitespace doesn't matter and needs no strip().
+    name_lc = (device.name or advertisement_data.local_name or "").lower()
+    if any(t in name_lc for t in _MELK_NAMES_LC):
+        _scan_found.set_result(device)
+
+
+def _close_scanner() -> None:
+    global _scanner
+    # resolve_device_address() always stops the scan; just drop the backend.
+    _scanner = None
 
 
 async def resolve_device_address() -> str:
-    global _resolved_device
+    global _resolved_device, _scanner, _scan_found
     if _resolved_device:
         return _resolved_device.address
 
-    devices = await BleakScanner.discover(timeout=SCAN_TIMEOUT_S)
-    for device in devices:
-        name = (device.name or "").strip()
-        if any(target.lower() in name.lower() for target in MELK_NAMES):
-            _resolved_device = device
-            return device.address
+    _scan_found = asyncio.get_running_loop().create_future()
+    if _scanner is None:
+        _scanner = BleakScanner(detection_callback=_on_scan_detect)
+
+    # Stop scanning as soon as the light advertises instead of waiting out the timeout.
+    await _scanner.start()
+    try:
+        _resolved_device = await asyncio.wait_for(_scan_found, timeout=SCAN_TIMEOUT_S)
+        return _resolved_device.address
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await _scanner.stop()
+        _scan_found = None
 
     raise RuntimeError(f"No BLE device found matching names: {', '.join(MELK_NAMES)}")
 
 
+def _load_cached_address() -> str | None:
+    try:
+        return CACHED_ADDRESS_PATH.read_text().strip() or None
+    except OSError:
+        return None
+
+
+def _save_cached_address(address: str | None) -> None:
+    try:
+        if address is None:
+            CACHED_ADDRESS_PATH.unlink(missing_ok=True)
+            return
+        CACHED_ADDRESS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        CACHED_ADDRESS_PATH.write_text(address)
+    except OSError:
+        pass
+
+
 def _idle_timeout_label() -> str:
     if _idle_timeout_s is None:
         return "off"
     return f"{_idle_timeout_s:.1f}s"
 
 
-def _cancel_idle_task_locked() -> None:
-    global _idle_task
-    if _idle_task is None:
-        return
-    if _idle_task is not asyncio.current_task():
-        _idle_task.cancel()
-    _idle_task = None
+def _disarm_idle_timer_locked() -> None:
+    global _idle_deadline, _idle_handle
+    _idle_deadline = 0.0
+    if _idle_handle is not None:
+        _idle_handle.cancel()
+        _idle_handle = None
 
 
-async def _idle_disconnect_worker(timeout_s: float) -> None:
-    try:
-        await asyncio.sleep(timeout_s)
-    except asyncio.CancelledError:
+def _on_idle_deadline() -> None:
+    global _idle_handle, _idle_task
+    _idle_handle = None
+    if not _idle_deadline:
         return
+    loop = asyncio.get_running_loop()
+    # The deadline moved later since this handle was scheduled; sleep for the remainder.
+    if loop.time() < _idle_deadline:
+        _idle_handle = loop.call_at(_idle_deadline, _on_idle_deadline)
+        return
+    _idle_task = asyncio.create_task(_idle_disconnect())
+
 
+async def _idle_disconnect() -> None:
+    global _idle_task
+    loop = asyncio.get_running_loop()
     async with _tx_lock:
-        # Only disconnect if this is still the active timer.
-        if _idle_task is not asyncio.current_task():
+        _idle_task = None
+        # A command may have run while we waited for the lock.
+        if not _idle_deadline or loop.time() < _idle_deadline:
+            _arm_idle_timer_locked()
             return
-        await _disconnect_client(reason=f"idle timeout ({timeout_s:.1f}s)")
+        await _disconnect_client(reason=f"idle timeout ({_idle_timeout_label()})")
         print("auto-disconnected")
 
 
+def _stop_idle_timer() -> None:
+    global _idle_task
+    _disarm_idle_timer_locked()
+    if _idle_task is not None:
+        _idle_task.cancel()
+        _idle_task = None
+
+
 def _arm_idle_timer_locked() -> None:
-    _cancel_idle_task_locked()
-    if _client is None or not _client.is_connected:
-        return
-    if _idle_timeout_s is None:
-        return
-    _idle = float(_idle_timeout_s)
-    if _idle <= 0:
+    global _idle_deadline, _idle_handle
+    # Check the configured timeout first so "idle off" costs a single comparison.
+    if _idle_timeout_s is None or _idle_timeout_s <= 0 or _client is None or not _connected:
+        if _idle_deadline:
+            _disarm_idle_timer_locked()
         return
-    global _idle_task
-    _idle_task = asyncio.create_task(_idle_disconnect_worker(_idle))
+    loop = asyncio.get_running_loop()
+    _idle_deadline = loop.time() + float(_idle_timeout_s)
+    # A later deadline is picked up when the existing handle fires.
+    if _idle_handle is None or _idle_deadline < _idle_handle.when():
+        if _idle_handle is not None:
+            _idle_handle.cancel()
+        _idle_handle = loop.call_at(_idle_deadline, _on_idle_deadline)
 
 
 async def _disconnect_client(reason: str = "") -> None:
-    global _client
-    _cancel_idle_task_locked()
+    global _client, _connected, _light_on
+    _disarm_idle_timer_locked()
+    _connected = False
+    # The light may be switched by other means while we're away; forget its power state.
+    _light_on = None
     if _client is None:
         return
     try:
         if _client.is_connected:
+            # Give the last response-less write its post-write delay before dropping the link.
+            wait = _next_write_ok - asyncio.get_running_loop().time()
+            if wait > 0:
+                await asyncio.sleep(wait)
             await _client.disconnect()
     finally:
         _client = None
 
 
+def _on_disconnect(client: BleakClient) -> None:
+    global _connected
+    # Callbacks from a client we already replaced must not clear the new link's state.
+    if client is not _client:
+        return
+    # Mark the link dead now so the next send reconnects instead of writing into it.
+    _connected = False
+    _disarm_idle_timer_locked()
+
+
 async def _ensure_connected() -> BleakClient:
-    global _client, _resolved_device
-    if _client is not None and _client.is_connected:
+    global _client, _connected, _resolved_device
+    if _client is not None and _connected:
         _arm_idle_timer_locked()
         return _client
 
     await _disconnect_client()
     last_error = None
+    cached_address = None if _resolved_device else _load_cached_address()
+    device_address = cached_address
     for attempt in (1, 2):
         try:
-            device_address = await resolve_device_address()
-            _client = BleakClient(device_address)
+            if device_address is None:
+                device_address = await resolve_device_address()
+            _client = BleakClient(
+                device_address, disconnected_callback=_on_disconnect, timeout=CLIENT_TIMEOUT_S
+            )
             await asyncio.wait_for(_client.connect(), timeout=CONNECT_TIMEOUT_S)
             if not _client.is_connected:
                 raise RuntimeError("Failed to connect")
+            _connected = True
+            if device_address != cached_address:
+                _save_cached_address(device_address)
             _arm_idle_timer_locked()
             return _client
+        except (BleakError, asyncio.TimeoutError) as e:
+            last_error = e
+            await _disconnect_client()
+            # A missing device is reported as not-found and rescans; other Bleak errors and
+            # timeouts on a freshly scanned address are connect races and retry it directly.
+            # The on-disk address may be stale in ways bleak can't tell, so any failure on it
+            # falls back to a scan.
+            if isinstance(e, BleakDeviceNotFoundError) or device_address == cached_address:
+                device_address = None
         except Exception as e:
             last_error = e
             await _disconnect_client()
-            # Retry once with a fresh scan in case the cached peripheral is stale.
+            device_address = None
+        if device_address is None:
+            # Retry with a fresh scan in case the cached peripheral is stale.
             _resolved_device = None
-            if attempt == 2:
-                break
-    raise RuntimeError(f"Unable to connect: {last_error}")
+            if cached_address:
+                _save_cached_address(None)
+                cached_address = None
+        if attempt == 1:
+            # Let the backend run its disconnect callbacks before retrying, without a timer.
+            await asyncio.sleep(0)
+    # Don't pin later commands to a device that just failed twice; rescan next time.
+    _resolved_device = None
+    raise RuntimeError(f"Unable to connect: {last_error!r}")
 
 
 async def ensure_connected() -> None:
@@ -163,24 +311,44 @@ async def set_idle_timeout(value: float | None) -> str:
         return _idle_timeout_label()
 
 
-async def send(payload: bytearray) -> None:
+async def send(payload: bytes | bytearray) -> None:
     """
     Write over a shared BLE connection.
     If a write fails due to a dropped link, reconnect once and retry.
     """
+    await send_many((payload,))
+
+
+async def send_many(payloads: Sequence[bytes | bytearray]) -> None:
+    """
+    Write several packets under one lock and connection check.
+    Packets are still spaced by POST_WRITE_DELAY_S, like separate sends.
+    """
+    global _next_write_ok, _light_on
     async with _tx_lock:
         client = await _ensure_connected()
-        try:
-            await client.write_gatt_char(WRITE_UUID, payload, response=WRITE_WITH_RESPONSE)
-        except Exception:
-            await _disconnect_client()
-            client = await _ensure_connected()
-            await client.write_gatt_char(WRITE_UUID, payload, response=WRITE_WITH_RESPONSE)
+        loop = asyncio.get_running_loop()
+        for payload in payloads:
+            # Only sleep for whatever is left of the previous write's delay.
+            wait = _next_write_ok - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await client.write_gatt_char(WRITE_UUID, payload, response=WRITE_WITH_RESPONSE)
+            except Exception:
+                await _disconnect_client()
+                await asyncio.sleep(0)
+                client = await _ensure_connected()
+                await client.write_gatt_char(WRITE_UUID, payload, response=WRITE_WITH_RESPONSE)
+            _next_write_ok = loop.time() + POST_WRITE_DELAY_S
+            if payload == PKT_ON:
+                _light_on = True
+            elif payload == PKT_OFF:
+                _light_on = False
+            if VERBOSE:
+                print(f"sent: {payload.hex(' ')}")
 
-        if POST_WRITE_DELAY_S:
-            await asyncio.sleep(POST_WRITE_DELAY_S)
         _arm_idle_timer_locked()
-        print(f"sent: {payload.hex(' ')}")
 
 
 def print_help() -> None:
@@ -202,14 +370,110 @@ def print_help() -> None:
     )
 
 
-async def command_loop() -> None:
-    presets = {
-        "red": (255, 0, 0),
-        "green": (0, 255, 0),
-        "blue": (0, 0, 255),
-        "white": (255, 255, 255),
-    }
+def _parse_raw(tokens: list[str]) -> bytes:
+    # Plain 1-2 digit tokens go through fromhex in one call; anything else ("0x7e", "+1")
+    # keeps the per-token int(x, 16) parse so each token is still exactly one byte.
+    if all(len(x) <= 2 for x in tokens):
+        try:
+            return bytes.fromhex("".join(x.zfill(2) for x in tokens))
+        except ValueError:
+            pass
+    return bytes(int(x, 16) for x in tokens)
+
+
+async def _send_color(payload: bytes | bytearray) -> None:
+    # Picking a color while we know the light is off should also turn it on.
+    if _light_on is False:
+        await send_many((PKT_ON, payload))
+        return
+    await send(payload)
+
+
+async def _cmd_preset(payload: bytes, parts: list[str]) -> None:
+    await _send_color(payload)
 
+
+async def _cmd_quit(parts: list[str]) -> bool:
+    await disconnect()
+    return True
+
+
+async def _cmd_help(parts: list[str]) -> None:
+    print_help()
+
+
+async def _cmd_connect(parts: list[str]) -> None:
+    await ensure_connected()
+    print("connected")
+
+
+async def _cmd_disconnect(parts: list[str]) -> None:
+    await disconnect()
+    print("disconnected")
+
+
+async def _cmd_reconnect(parts: list[str]) -> None:
+    await reconnect()
+    print("reconnected")
+
+
+async def _cmd_status(parts: list[str]) -> None:
+    print(await connection_status())
+
+
+async def _cmd_idle(parts: list[str]) -> None:
+    if len(parts) == 1:
+        print(f"idle timeout: {_idle_timeout_label()}")
+        return
+    if len(parts) != 2:
+        print("usage: idle <sec|off>")
+        return
+    arg = parts[1].lower()
+    if arg == "off":
+        label = await set_idle_timeout(None)
+        print(f"idle timeout set to {label}")
+        return
+    seconds = float(parts[1])
+    if seconds <= 0:
+        raise ValueError("idle seconds must be > 0, or use 'off'")
+    label = await set_idle_timeout(seconds)
+    print(f"idle timeout set to {label}")
+
+
+async def _cmd_color(parts: list[str]) -> None:
+    if len(parts) != 4:
+        print("usage: color R G B   (each 0-255)")
+        return
+    r, g, b = (int(parts[1]), int(parts[2]), int(parts[3]))
+    await _send_color(pkt_color(r, g, b))
+
+
+async def _cmd_raw(parts: list[str]) -> None:
+    if len(parts) < 2:
+        print("usage: raw <hex bytes...>")
+        return
+    await send(_parse_raw(parts[1:]))
+
+
+# Handlers take the split command line; returning True ends the loop.
+COMMANDS: dict[str, Callable[[list[str]], Awaitable[bool | None]]] = {
+    "quit": _cmd_quit,
+    "exit": _cmd_quit,
+    "help": _cmd_help,
+    "connect": _cmd_connect,
+    "disconnect": _cmd_disconnect,
+    "reconnect": _cmd_reconnect,
+    "status": _cmd_status,
+    "idle": _cmd_idle,
+    "on": lambda parts: send(PKT_ON),
+    "off": lambda parts: send(PKT_OFF),
+    "color": _cmd_color,
+    "raw": _cmd_raw,
+}
+COMMANDS.update({name: partial(_cmd_preset, payload) for name, payload in PRESETS.items()})
+
+
+async def command_loop() -> None:
     print_help()
 
     while True:
@@ -219,84 +483,14 @@ async def command_loop() -> None:
 
         parts = line.split()
         cmd = parts[0].lower()
+        handler = COMMANDS.get(cmd)
+        if handler is None:
+            print(f"unknown command: {cmd} (type 'help')")
+            continue
 
         try:
-            if cmd in ("quit", "exit"):
-                await disconnect()
+            if await handler(parts):
                 return
-
-            if cmd == "help":
-                print_help()
-                continue
-
-            if cmd == "connect":
-                await ensure_connected()
-                print("connected")
-                continue
-
-            if cmd == "disconnect":
-                await disconnect()
-                print("disconnected")
-                continue
-
-            if cmd == "reconnect":
-                await reconnect()
-                print("reconnected")
-                continue
-
-            if cmd == "status":
-                print(await connection_status())
-                continue
-
-            if cmd == "idle":
-                if len(parts) == 1:
-                    print(f"idle timeout: {_idle_timeout_label()}")
-                    continue
-                if len(parts) != 2:
-                    print("usage: idle <sec|off>")
-                    continue
-                arg = parts[1].lower()
-                if arg == "off":
-                    label = await set_idle_timeout(None)
-                    print(f"idle timeout set to {label}")
-                    continue
-                seconds = float(parts[1])
-                if seconds <= 0:
-                    raise ValueError("idle seconds must be > 0, or use 'off'")
-                label = await set_idle_timeout(seconds)
-                print(f"idle timeout set to {label}")
-                continue
-
-            if cmd == "on":
-                await send(pkt_power(True))
-                continue
-
-            if cmd == "off":
-                await send(pkt_power(False))
-                continue
-
-            if cmd in presets:
-                r, g, b = presets[cmd]
-                await send(pkt_color(r, g, b))
-                continue
-
-            if cmd == "color":
-                if len(parts) != 4:
-                    print("usage: color R G B   (each 0-255)")
-                    continue
-                r, g, b = (int(parts[1]), int(parts[2]), int(parts[3]))
-                await send(pkt_color(r, g, b))
-                continue
-
-            if cmd == "raw":
-                if len(parts) < 2:
-                    print("usage: raw <hex bytes...>")
-                    continue
-                data = bytearray(int(x, 16) for x in parts[1:])
-                await send(data)
-                continue
-
-            print(f"unknown command: {cmd} (type 'help')")
         except Exception as e:
             print(f"error: {e}")
 
@@ -306,7 +500,21 @@ async def main():
         await command_loop()
     finally:
         await disconnect()
+        _stop_idle_timer()
+        _close_scanner()
+        _stdin_pool.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional; it speeds up the timer-heavy send/idle paths when installed.
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        if hasattr(uvloop, "run"):
+            uvloop.run(main())
+        else:
+            # uvloop.run() only exists from uvloop 0.18; older releases install via the policy.
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(main())